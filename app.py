@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from subprocess import call, Popen, PIPE
+import hashlib
 import json
 import os
 from os.path import expanduser
@@ -8,11 +9,12 @@ import re
 import shutil
 import sys
 import getpass
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 
 
 COMMAND, ENV, APP_TYPE, FRESH_INSTALL = None, None, None, False
 RELEASE_TYPE, RELEASE_CANDIDATE_TYPE = None, None
+PROFILE_SESSION, PROFILE_PID = None, None
 # VERSIONS:
 NODE_VERSION = "v10.15.3"
 NG_CLI_VERSION = "7.3.8"
@@ -23,6 +25,16 @@ BACKEND_FOLDER_NAME = "server"
 WEB_APP_FOLDER_NAME = "web-app"
 PACKAGE_JSON_FILE = "package.json"
 YAML_FILE = "app.yaml"
+PROFILES_FOLDER_NAME = "profiles"
+# Worker profiles are named `<session>.<instance>.worker-<pid>.<started_at>.collapsed`
+# by server/services/profiler.py
+PROFILE_FILE_PATTERN = re.compile(r"^(?P<session>[A-Za-z0-9-]+)\.(?P<instance>[A-Za-z0-9-]+)"
+                                  r"\.worker-(?P<pid>\d+)\.(?P<started_at>\d+)\.collapsed$")
+DIST_FOLDER_NAME = "dist"
+SERVICE_WORKER_FILE = "service-worker.js"
+PRECACHE_MANIFEST_FILE = "precache-manifest.json"
+# Files in dist that are not precached. index.html is fetched network first as the app shell
+PRECACHE_EXCLUDED_FILES = ["index.html", "3rdpartylicenses.txt", SERVICE_WORKER_FILE, PRECACHE_MANIFEST_FILE]
 
 
 CURRENT_WORKING_DIRECTORY = os.getcwd()
@@ -30,6 +42,9 @@ BACKEND_PATH = f"{CURRENT_WORKING_DIRECTORY}/{BACKEND_FOLDER_NAME}"
 VIRTUAL_ENV_PATH = f"{BACKEND_PATH}/env"
 WEB_APP_PATH = f"{CURRENT_WORKING_DIRECTORY}/{WEB_APP_FOLDER_NAME}"
 PACKAGE_JSON_PATH = f"{WEB_APP_PATH}/package.json"
+PROFILES_PATH = f"{BACKEND_PATH}/{PROFILES_FOLDER_NAME}"
+DIST_PATH = f"{BACKEND_PATH}/{DIST_FOLDER_NAME}"
+SERVICE_WORKER_TEMPLATE_PATH = f"{WEB_APP_PATH}/src/{SERVICE_WORKER_FILE}"
 
 
 class Colors:
@@ -509,22 +524,137 @@ class Angular:
         """
         Colors.print_msg("Building  Angular app.", Colors.PURPLE)
         os.chdir(WEB_APP_PATH)
-        Nvm.run_command(["ng build --prod"])
+        if Nvm.run_command(["ng build --prod"]) != 0:
+            Colors.print_msg("Angular build failed. ABORTING THE MISSION", Colors.RED)
+            sys.exit(3)
+        ServiceWorker.generate()
+
+
+class ServiceWorker:
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def get_precache_manifest() -> dict:
+        """
+        Hash every file of the Angular build that the service worker should precache
+        :return: {dict} manifest with the version and the url, hash and size of each file
+        """
+        hashed_bundle_pattern = re.compile(r".+\.[a-f0-9]{16,}\.(js|css)$")
+        assets = []
+        for root, _, file_names in os.walk(DIST_PATH):
+            for file_name in file_names:
+                file_path = os.path.join(root, file_name)
+                relative_path = os.path.relpath(file_path, DIST_PATH).replace(os.sep, "/")
+                if relative_path in PRECACHE_EXCLUDED_FILES or file_name.endswith(".map"):
+                    continue
+                with open(file_path, "rb") as asset:
+                    content = asset.read()
+                assets.append(OrderedDict([
+                    ("url", f"/{relative_path}"),
+                    ("hash", hashlib.sha256(content).hexdigest()),
+                    ("size", len(content)),
+                    ("hashed", bool(hashed_bundle_pattern.match(file_name))),
+                ]))
+        assets.sort(key=lambda entry: entry["url"])
+        version = hashlib.sha256("\n".join(f"{entry['url']} {entry['hash']}" for entry in assets).encode("utf-8"))
+        return OrderedDict([("version", version.hexdigest()[:20]), ("assets", assets)])
+
+    @staticmethod
+    def generate():
+        """
+        Write the precache manifest and the service worker into the Angular build folder
+        """
+        if not os.path.isdir(DIST_PATH):
+            Colors.print_msg(f"Angular build not found in {DIST_PATH}. Skipping service worker.", Colors.YELLOW)
+            return
+        manifest = ServiceWorker.get_precache_manifest()
+        with open(f"{DIST_PATH}/{PRECACHE_MANIFEST_FILE}", "w") as outfile:
+            json.dump(manifest, outfile, indent=2, separators=(",", ": "))
+        with open(SERVICE_WORKER_TEMPLATE_PATH) as template:
+            service_worker = template.read().replace("'__PRECACHE_VERSION__'", f"'{manifest['version']}'")
+        with open(f"{DIST_PATH}/{SERVICE_WORKER_FILE}", "w") as outfile:
+            outfile.write(service_worker)
+        total_size = sum(entry["size"] for entry in manifest["assets"])
+        Colors.print_success_with_icon(f"Service worker precaches {len(manifest['assets'])} files "
+                                       f"({total_size} bytes), version {manifest['version']}")
+
+
+class Profiler:
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def download():
+        """
+        Download the worker profiles that App Engine instances uploaded to the default GCS bucket
+        """
+        session = PROFILE_SESSION or "*"
+        pid = PROFILE_PID or "*"
+        source = f"gs://{ENV.gcp_project_id}.appspot.com/{PROFILES_FOLDER_NAME}/{session}.*.worker-{pid}.*.collapsed"
+        os.makedirs(PROFILES_PATH, exist_ok=True)
+        Colors.print_msg(f"Downloading profiles from {source}", Colors.BLUE)
+        if Utils.run_command(f"gsutil -m cp \"{source}\" {PROFILES_PATH}") != 0:
+            Colors.print_msg(f"Unable to download profiles from {source}", Colors.RED)
+            sys.exit(1)
+
+    @staticmethod
+    def merge():
+        """
+        Merge the collapsed stacks written by each gunicorn worker into a single profile.
+        Only the files of `session=<session>` and/or `pid=<pid>` are merged when given
+        """
+        profile_files = []
+        sessions = set()
+        if os.path.isdir(PROFILES_PATH):
+            for name in sorted(os.listdir(PROFILES_PATH)):
+                matched = PROFILE_FILE_PATTERN.match(name)
+                if not matched:
+                    continue
+                if PROFILE_SESSION and matched.group("session") != PROFILE_SESSION:
+                    continue
+                if PROFILE_PID and matched.group("pid") != PROFILE_PID:
+                    continue
+                profile_files.append(name)
+                sessions.add(matched.group("session"))
+        if not profile_files:
+            Colors.print_msg(f"No matching profiles found in {PROFILES_PATH}", Colors.YELLOW)
+            sys.exit(1)
+        if len(sessions) > 1:
+            Colors.print_msg(f"Merging {len(sessions)} sessions: {', '.join(sorted(sessions))}. "
+                             f"Pass session=<session> to merge only one.", Colors.YELLOW)
+        stacks = Counter()
+        for file_name in profile_files:
+            with open(f"{PROFILES_PATH}/{file_name}") as profile_content:
+                for line in profile_content:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    if stack and count.isdigit():
+                        stacks[stack] += int(count)
+        merged_name = f"merged-{PROFILE_SESSION or 'all'}"
+        if PROFILE_PID:
+            merged_name += f"-worker-{PROFILE_PID}"
+        merged_path = f"{PROFILES_PATH}/{merged_name}.collapsed"
+        with open(merged_path, "w") as outfile:
+            for stack, count in stacks.most_common():
+                outfile.write(f"{stack} {count}\n")
+        Colors.print_success_with_icon(f"Merged {len(profile_files)} worker profiles into {merged_path}")
 
 
 def parse_args():
     """
     Parse the arguments passed via command line
     """
-    global COMMAND, FRESH_INSTALL, APP_TYPE, ENV, RELEASE_TYPE, RELEASE_CANDIDATE_TYPE
+    global COMMAND, FRESH_INSTALL, APP_TYPE, ENV, RELEASE_TYPE, RELEASE_CANDIDATE_TYPE, PROFILE_SESSION, PROFILE_PID
     possible_version_format = re.compile(r"version=[a-zA-Z\d-]*")
+    possible_session_format = re.compile(r"session=[a-zA-Z\d-]+$")
+    possible_pid_format = re.compile(r"pid=\d+$")
     skip_next_iter = False
     for index, arg in enumerate(all_args):
         if skip_next_iter:
             # Need this if passing version as `version 0-0-2-as`
             skip_next_iter = False
             continue
-        elif arg in ["-d", "deploy", "-s", "setup", "-h", "help", "-r", "run", "-b", "build"]:
+        elif arg in ["-d", "deploy", "-s", "setup", "-h", "help", "-r", "run", "-b", "build", "-p", "profile"]:
             if COMMAND:
                 Utils.print_error_show_help(f"More than one command provide {COMMAND} and {arg}")
             COMMAND = arg
@@ -543,6 +673,10 @@ def parse_args():
             if not version:
                 Utils.print_error_show_help("Missing version")
             ENV.set_deploy_version(version)
+        elif possible_session_format.match(arg):
+            PROFILE_SESSION = arg[arg.index("=") + 1:]
+        elif possible_pid_format.match(arg):
+            PROFILE_PID = arg[arg.index("=") + 1:]
         elif arg in ["major", "minor", "patch"]:
             RELEASE_TYPE = arg
         elif arg in ["rc", "alpha", "beta"]:
@@ -579,6 +713,10 @@ def execute_command():
             pass
     elif COMMAND in ["-b", "build"]:
         Angular.build()
+    elif COMMAND in ["-p", "profile"]:
+        if is_gae:
+            Profiler.download()
+        Profiler.merge()
     elif COMMAND in ["-h", "help"]:
         Utils.show_help()
 
@@ -2,4 +2,25 @@ import multiprocessing
 
 # Documentation
 # http://docs.gunicorn.org/en/stable/settings.html#worker-processes
-workers = multiprocessing.cpu_count() * 2 + 1
\ No newline at end of file
+workers = multiprocessing.cpu_count() * 2 + 1
+
+
+# http://docs.gunicorn.org/en/stable/settings.html#server-hooks
+def post_worker_init(worker):
+    """
+    Let `kill -USR2 <worker pid>` start the sampling profiler in that worker
+    :param worker: {Worker}
+    """
+    from services.profiler import install_signal_handler
+    install_signal_handler()
+
+
+def worker_exit(server, worker):
+    """
+    Flush the samples of a running profiling session to the local file before the worker exits.
+    The GCS upload is skipped and the wait is bounded so shutdown never hangs on the network
+    :param server: {Arbiter}
+    :param worker: {Worker}
+    """
+    from services.profiler import stop_profiling
+    stop_profiling(upload=False, timeout=5)
@@ -1,9 +1,13 @@
 from services.autoload import activate_virtual_env
 activate_virtual_env()
 
+import hmac
 import os
-from flask import Flask, render_template, request, redirect, url_for, session
-from services.config import FLASK_APP_SECRET
+from flask import Flask, render_template, request, redirect, url_for, session, abort, jsonify, send_from_directory, \
+    make_response
+from services.config import FLASK_APP_SECRET, PROFILER_ADMIN_TOKEN, PROFILER_SAMPLE_RATE, PROFILER_DURATION, \
+    PROFILER_MAX_SAMPLE_RATE, PROFILER_MAX_DURATION
+from services.profiler import start_profiling, SESSION_PATTERN
 
 # If `entrypoint` is not defined in app.yaml, App Engine will look for an app
 # called `app` in `main.py`.
@@ -18,6 +22,65 @@ app = Flask(__name__, template_folder=template_dir, static_folder=template_dir)
 app.secret_key = FLASK_APP_SECRET
 
 
+def get_int_arg(name: str, default: int, maximum: int) -> int:
+    """
+    Read a positive integer query param, aborting with 400 if it is invalid or above `maximum`
+    :param name: {str} query param name
+    :param default: {int} value used when the param is missing
+    :param maximum: {int}
+    :return: {int}
+    """
+    value = request.args.get(name)
+    if value is None:
+        return default
+    message = f"`{name}` must be an integer between 1 and {maximum}"
+    # isdigit() alone accepts characters such as "²" that int() rejects
+    if not value.isascii() or not value.isdigit():
+        abort(400, message)
+    if not 1 <= int(value) <= maximum:
+        abort(400, message)
+    return int(value)
+
+
+@app.route('/_admin/profile', methods=["POST"])
+def profile():
+    """
+    Start the sampling profiler in the worker serving this request.
+    Requires the `X-Profiler-Token` header to match `PROFILER_ADMIN_TOKEN`
+    Optional query params: `rate` (samples per second, up to PROFILER_MAX_SAMPLE_RATE)
+    and `seconds` (up to PROFILER_MAX_DURATION). Pass the same `session` to every call
+    that should end up in the same merged profile
+    :return: JSON with the worker pid and the session settings
+    """
+    if not PROFILER_ADMIN_TOKEN:
+        abort(404)
+    # compare_digest only accepts ASCII str, bytes work for any header value
+    token = request.headers.get("X-Profiler-Token", "").encode("utf-8")
+    if not hmac.compare_digest(token, PROFILER_ADMIN_TOKEN.encode("utf-8")):
+        abort(403)
+    rate = get_int_arg("rate", PROFILER_SAMPLE_RATE, PROFILER_MAX_SAMPLE_RATE)
+    seconds = get_int_arg("seconds", PROFILER_DURATION, PROFILER_MAX_DURATION)
+    session_name = request.args.get("session")
+    if session_name is not None and not SESSION_PATTERN.match(session_name):
+        abort(400, "`session` must be 1 to 64 letters, digits or hyphens")
+    profiler = start_profiling(rate=rate, duration=seconds, session=session_name)
+    if profiler is None:
+        return jsonify(pid=os.getpid(), error="Profiler is already running"), 409
+    return jsonify(pid=os.getpid(), rate=rate, seconds=seconds, session=profiler.session), 202
+
+
+@app.route('/service-worker.js', methods=["GET"])
+@app.route('/precache-manifest.json', methods=["GET"])
+def service_worker():
+    """
+    Serve the service worker and its precache manifest generated by `app.py build`.
+    Both must be revalidated on every load so the browser picks up new builds
+    :return: The requested file with no-cache headers
+    """
+    response = send_from_directory(template_dir, request.path.lstrip("/"), cache_timeout=0)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
 
 @app.route('/', defaults={'path': ''}, methods=["GET"])
 @app.route('/<path:path>', methods=["GET"])
@@ -27,7 +90,10 @@ def index(path: str):
     :param path: {path} the url path
     :return: App rendered template
     """
-    return render_template("/index.html")
+    response = make_response(render_template("/index.html"))
+    # Lets the service worker tell the app shell apart from other HTML pages
+    response.headers["X-App-Shell"] = "1"
+    return response
 
 
 if __name__ == "__main__":
@@ -13,4 +13,22 @@ APP_BASE_URL = "http://localhost:8080"
 if "GOOGLE_CLOUD_PROJECT" in os.environ:
     APP_BASE_URL = f"https://{os.environ['GOOGLE_CLOUD_PROJECT']}.appspot.com"
     IS_PROD = os.environ['GOOGLE_CLOUD_PROJECT'] == os.environ['PROD_APP_ID']
-    IS_LOCAL_HOST = False
\ No newline at end of file
+    IS_LOCAL_HOST = False
+
+# Sampling profiler configuration
+# App Engine only allows writing to /tmp
+LOCAL_PROFILER_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "profiles")
+PROFILER_OUTPUT_DIR = os.environ.get("PROFILER_OUTPUT_DIR",
+                                     LOCAL_PROFILER_OUTPUT_DIR if IS_LOCAL_HOST else "/tmp/profiles")
+PROFILER_SAMPLE_RATE = int(os.environ.get("PROFILER_SAMPLE_RATE", 100))
+PROFILER_DURATION = int(os.environ.get("PROFILER_DURATION", 30))
+# Upper limits for a single session
+PROFILER_MAX_SAMPLE_RATE = 1000
+PROFILER_MAX_DURATION = 300
+# Finished profiles are uploaded to `gs://<bucket>/<folder>/` so `app.py profile gae` can fetch them.
+# The /tmp of an App Engine instance is not reachable from outside. Uploads are off when the bucket is empty
+PROFILER_GCS_BUCKET = os.environ.get("PROFILER_GCS_BUCKET",
+                                     "" if IS_LOCAL_HOST else f"{os.environ['GOOGLE_CLOUD_PROJECT']}.appspot.com")
+PROFILER_GCS_FOLDER = "profiles"
+# The admin endpoint is disabled unless a token is set
+PROFILER_ADMIN_TOKEN = os.environ.get("PROFILER_ADMIN_TOKEN", "")
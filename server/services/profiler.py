@@ -0,0 +1,163 @@
+import logging
+import os
+import re
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from services.config import PROFILER_OUTPUT_DIR, PROFILER_SAMPLE_RATE, PROFILER_DURATION, \
+    PROFILER_MAX_SAMPLE_RATE, PROFILER_MAX_DURATION, PROFILER_GCS_BUCKET, PROFILER_GCS_FOLDER
+
+# Session names end up in file and object names
+SESSION_PATTERN = re.compile(r"^[A-Za-z0-9-]{1,64}$")
+# Worker PIDs repeat across App Engine instances, so file names also carry the instance
+INSTANCE_ID = re.sub(r"[^A-Za-z0-9-]", "-", os.environ.get("GAE_INSTANCE") or socket.gethostname())
+
+# Only one sampling session is allowed per worker process at a time
+_lock = threading.Lock()
+_active_profiler = None
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Sample the stacks of every other thread in this process and write them in
+    the collapsed format understood by flamegraph.pl and speedscope
+    """
+
+    def __init__(self, rate: int = PROFILER_SAMPLE_RATE, duration: int = PROFILER_DURATION,
+                 output_dir: str = PROFILER_OUTPUT_DIR, session: str = None):
+        super().__init__(name="sampling-profiler", daemon=True)
+        # Files of the same session are merged together by `app.py profile session=<session>`
+        self.session = session or time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        # Keeps a later run of the same session in the same worker from overwriting this one
+        self.started_at = int(time.time() * 1000)
+        self.interval = 1.0 / min(max(int(rate), 1), PROFILER_MAX_SAMPLE_RATE)
+        self.duration = min(max(float(duration), 0), PROFILER_MAX_DURATION)
+        self.output_dir = output_dir
+        self.output_path = None
+        self.upload = bool(PROFILER_GCS_BUCKET)
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def collapse_frame(frame) -> str:
+        """
+        Collapse a frame and its callers into a single root first line
+        :param frame: {frame} innermost frame of the thread
+        :return: {str}
+        """
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def sample(self):
+        """
+        Record the current stack of every thread except the profiler itself
+        """
+        own_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != own_id:
+                self.stacks[self.collapse_frame(frame)] += 1
+
+    def run(self):
+        deadline = time.monotonic() + self.duration
+        while not self._stop_event.is_set() and time.monotonic() < deadline:
+            self.sample()
+            self._stop_event.wait(self.interval)
+        self.write()
+        _clear_active(self)
+
+    def stop(self, upload: bool = True):
+        """
+        Stop sampling early. The samples collected so far are still written
+        :param upload: {bool} set to False to only write the local file
+        """
+        if not upload:
+            self.upload = False
+        self._stop_event.set()
+
+    def write(self):
+        """
+        Write the samples to `<output_dir>/<session>.<instance>.worker-<pid>.<started_at>.collapsed`
+        and upload them to PROFILER_GCS_BUCKET when it is set
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        file_name = f"{self.session}.{INSTANCE_ID}.worker-{os.getpid()}.{self.started_at}.collapsed"
+        self.output_path = os.path.join(self.output_dir, file_name)
+        with open(self.output_path, "w") as outfile:
+            for stack, count in self.stacks.items():
+                outfile.write(f"{stack} {count}\n")
+        if self.upload:
+            upload_profile(self.output_path)
+
+
+def upload_profile(file_path: str):
+    """
+    Upload a profile to `gs://<PROFILER_GCS_BUCKET>/<PROFILER_GCS_FOLDER>/`.
+    Failures are logged, the local file is kept either way
+    :param file_path: {str}
+    """
+    try:
+        from google.cloud import storage
+        blob_name = f"{PROFILER_GCS_FOLDER}/{os.path.basename(file_path)}"
+        storage.Client().bucket(PROFILER_GCS_BUCKET).blob(blob_name).upload_from_filename(file_path)
+    except Exception:
+        logging.getLogger(__name__).exception(f"Unable to upload {file_path} to {PROFILER_GCS_BUCKET}")
+
+
+def _clear_active(profiler: SamplingProfiler):
+    global _active_profiler
+    with _lock:
+        if _active_profiler is profiler:
+            _active_profiler = None
+
+
+def start_profiling(rate: int = PROFILER_SAMPLE_RATE, duration: int = PROFILER_DURATION, session: str = None,
+                    blocking: bool = True):
+    """
+    Start a sampling session in this worker unless one is already running
+    :param rate: {int} samples per second
+    :param duration: {int} seconds to sample for
+    :param session: {str} name shared by the files of the session. Defaults to the UTC start time
+    :param blocking: {bool} wait for the lock. Must be False in signal handlers, which can interrupt its holder
+    :return: {SamplingProfiler} the new session, or None if one is already running or the lock is busy
+    """
+    global _active_profiler
+    if not _lock.acquire(blocking=blocking):
+        return None
+    try:
+        if _active_profiler is not None:
+            return None
+        _active_profiler = SamplingProfiler(rate=rate, duration=duration, session=session)
+        _active_profiler.start()
+        return _active_profiler
+    finally:
+        _lock.release()
+
+
+def stop_profiling(upload: bool = True, timeout: float = None):
+    """
+    Stop the running session, if any, and wait for its samples to be written
+    :param upload: {bool} set to False to skip the GCS upload and only write the local file
+    :param timeout: {float} seconds to wait at most. Waits until the samples are written by default
+    """
+    with _lock:
+        profiler = _active_profiler
+    if profiler is not None:
+        profiler.stop(upload=upload)
+        profiler.join(timeout)
+
+
+def install_signal_handler(signum: int = signal.SIGUSR2):
+    """
+    Start a sampling session with the default settings when the worker receives `signum`.
+    Nothing runs until the signal arrives. The signal is ignored if another session is being started or stopped.
+    Note: Send the signal to worker PIDs only, SIGUSR2 on the gunicorn master upgrades the binary
+    :param signum: {int}
+    """
+    signal.signal(signum, lambda *_: start_profiling(blocking=False))
@@ -9,4 +9,11 @@ if (environment.production) {
 }
 
 platformBrowserDynamic().bootstrapModule(AppModule)
+  .then(() => {
+    // service-worker.js is generated by `app.py build`, so it only exists in production builds
+    if (environment.production && 'serviceWorker' in navigator) {
+      navigator.serviceWorker.register('/service-worker.js')
+        .catch(err => console.error(err));
+    }
+  })
   .catch(err => console.error(err));
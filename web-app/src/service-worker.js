@@ -0,0 +1,113 @@
+// Service worker template. `app.py build` writes it to server/dist/service-worker.js with
+// PRECACHE_VERSION set to the version of server/dist/precache-manifest.json, so every
+// build that changes a file also changes this script and makes the browser install the update.
+const PRECACHE_VERSION = '__PRECACHE_VERSION__';
+const MANIFEST_URL = '/precache-manifest.json';
+const MANIFEST_KEY = `${MANIFEST_URL}?__rev=${PRECACHE_VERSION}`;
+const PRECACHE = 'precache';
+const SHELL_CACHE = 'shell';
+const SHELL_URL = '/';
+// Set by index() in server/main.py, so static HTML such as /docs is never cached as the shell
+const SHELL_HEADER = 'X-App-Shell';
+
+let precacheKeys = null;
+
+// Bundles with a content hash in the file name never change, other files are keyed by their hash
+const cacheKey = entry => entry.hashed ? entry.url : `${entry.url}?__rev=${entry.hash}`;
+
+const toKeys = manifest => manifest.assets.reduce((keys, entry) => {
+  keys[entry.url] = cacheKey(entry);
+  return keys;
+}, {});
+
+// Map of url path => cache key for the version this worker was built with
+const getPrecacheKeys = () => {
+  if (!precacheKeys) {
+    precacheKeys = caches.open(PRECACHE)
+      .then(cache => cache.match(MANIFEST_KEY))
+      .then(response => response ? response.json() : {assets: []})
+      .then(toKeys);
+  }
+  return precacheKeys;
+};
+
+self.addEventListener('install', event => {
+  event.waitUntil(
+    fetch(MANIFEST_URL, {cache: 'no-store'})
+      .then(response => response.json())
+      .then(manifest => {
+        if (manifest.version !== PRECACHE_VERSION) {
+          throw new Error(`Precache manifest ${manifest.version} does not match ${PRECACHE_VERSION}`);
+        }
+        return caches.open(PRECACHE).then(cache => Promise.all(manifest.assets.map(entry => {
+          const key = cacheKey(entry);
+          // Only download the files that changed since the previous version
+          return cache.match(key).then(cached => cached || fetch(entry.url, {cache: 'no-cache'}).then(response => {
+            if (!response.ok) {
+              throw new Error(`Unable to precache ${entry.url}: ${response.status}`);
+            }
+            return cache.put(key, response);
+          }));
+        })).then(() => cache.put(MANIFEST_KEY, new Response(JSON.stringify(manifest)))));
+      })
+      .then(() => caches.open(SHELL_CACHE))
+      .then(cache => cache.add(new Request(SHELL_URL, {cache: 'no-cache'})))
+  );
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    getPrecacheKeys()
+      .then(keys => {
+        const current = Object.keys(keys).map(url => new URL(keys[url], self.location).href);
+        current.push(new URL(MANIFEST_KEY, self.location).href);
+        // Drop the files of previous versions. There is no skipWaiting(), so this only runs
+        // once no tab is controlled by the previous worker and still needs them
+        return caches.open(PRECACHE).then(cache => cache.keys().then(requests => Promise.all(
+          requests.filter(request => current.indexOf(request.url) === -1).map(request => cache.delete(request))
+        )));
+      })
+      .then(() => self.clients.claim())
+  );
+});
+
+const getCachedShell = () => caches.open(SHELL_CACHE).then(cache => cache.match(SHELL_URL));
+
+// Network first for the index() shell so deploys show up straight away, stale shell when offline or on errors
+const networkFirstShell = request => fetch(request)
+  .then(response => {
+    if (!response.ok) {
+      return getCachedShell().then(cached => cached || response);
+    }
+    if (response.headers.get(SHELL_HEADER)) {
+      const copy = response.clone();
+      caches.open(SHELL_CACHE).then(cache => cache.put(SHELL_URL, copy));
+    }
+    return response;
+  })
+  .catch(err => getCachedShell().then(cached => {
+    if (!cached) {
+      throw err;
+    }
+    return cached;
+  }));
+
+// Cache first for the precached files. URLs missing from this worker's manifest are still looked up in the
+// precache: while it waits to be replaced, the cached shell can be a newer build whose hashed bundles were
+// precached by the next worker's install
+const cacheFirst = (request, pathname) => getPrecacheKeys()
+  .then(keys => caches.open(PRECACHE).then(cache => cache.match(keys[pathname] || request)))
+  .then(cached => cached || fetch(request));
+
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (request.method !== 'GET' || url.origin !== self.location.origin) {
+    return;
+  }
+  if (request.mode === 'navigate') {
+    event.respondWith(networkFirstShell(request));
+  } else {
+    event.respondWith(cacheFirst(request, url.pathname));
+  }
+});